@@ -0,0 +1,61 @@
+# Card database load-time benchmark.
+#
+# Measures cold start (parse cards.json, build the index and render every card)
+# against loading the precompiled artifact, as the database grows by synthetic
+# Joker entries. Run from the repository root:
+#
+#   python -m benchmarks.bench_card_db [extra entry counts...]
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from card_db import CARDS_PATH, build_artifact, load_card_db
+
+words = [
+    "Greedy", "Lusty", "Wrathful", "Gluttonous", "Jolly", "Zany", "Mad", "Crazy",
+    "Droll", "Sly", "Wily", "Clever", "Devious", "Crafty", "Half", "Stencil",
+    "Mystic", "Raised", "Fist", "Chaos", "Scary", "Abstract", "Delayed", "Hack",
+]
+
+
+# Extra cards shaped like real Joker entries
+def synthetic_cards(count):
+    cards = {}
+    for i in range(count):
+        name = f"{words[i % len(words)]} {words[(i // len(words)) % len(words)]} Joker {i}"
+        cards[name] = f"+{i % 20 + 1} Mult for each played card of a matching rank, resets at end of round ({i})"
+    return cards
+
+
+def timed(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def run(extra_counts, repeat=20):
+    with open(CARDS_PATH, "r", encoding="utf-8") as file:
+        data = json.load(file)
+    print(f"{'cards':>6} {'cold build ms':>14} {'artifact load ms':>17} {'artifact KB':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        source_path = os.path.join(directory, "cards.json")
+        artifact_path = os.path.join(directory, "cards.db")
+        for extra in extra_counts:
+            cards = dict(data["cards"])
+            cards.update(synthetic_cards(extra))
+            with open(source_path, "w", encoding="utf-8") as file:
+                json.dump({"version": data["version"], "cards": cards}, file)
+            cold = timed(lambda: build_artifact(source_path, artifact_path), repeat)
+            warm = timed(lambda: load_card_db(source_path, artifact_path), repeat)
+            size = os.path.getsize(artifact_path) / 1024
+            print(f"{len(cards):>6} {cold:>14.2f} {warm:>17.2f} {size:>12.1f}")
+
+
+if __name__ == "__main__":
+    run([int(count) for count in sys.argv[1:]] or [0, 150, 500, 1000])
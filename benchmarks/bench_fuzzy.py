@@ -0,0 +1,80 @@
+# Fuzzy matching benchmark: the trigram-indexed FuzzyIndex against a brute-force
+# edit-distance scan over every target, as the card database grows. Reports the
+# time per lookup for both and how often they agree. Run from the repository
+# root:
+#
+#   python -m benchmarks.bench_fuzzy [extra entry counts...]
+import json
+import random
+import string
+import sys
+import time
+
+from benchmarks.bench_card_db import synthetic_cards
+from card_db import CARDS_PATH
+from matcher import FuzzyIndex, bounded_levenshtein, normalize
+
+
+# What FuzzyIndex.lookup would return if it checked every target
+def brute_force(fuzzy, card_name):
+    text = normalize(card_name)
+    if len(text) < fuzzy.min_length:
+        return None
+    best = None
+    for target, position in fuzzy.targets:
+        longest = max(len(text), len(target))
+        max_distance = int(longest * (1 - fuzzy.threshold) + 1e-9)
+        distance = bounded_levenshtein(text, target, max_distance)
+        if distance is None:
+            continue
+        score = (1 - distance / longest, -position)
+        if best is None or score > best:
+            best = score
+    if best is None:
+        return None
+    return fuzzy.names[-best[1]]
+
+
+# One random insertion, deletion, substitution or transposition
+def typo(name, rng):
+    i = rng.randrange(len(name))
+    kind = rng.randrange(4)
+    if kind == 0:
+        return name[:i] + rng.choice(string.ascii_lowercase) + name[i:]
+    if kind == 1 and len(name) > 1:
+        return name[:i] + name[i + 1:]
+    if kind == 2:
+        return name[:i] + rng.choice(string.ascii_lowercase) + name[i + 1:]
+    if i + 1 < len(name):
+        return name[:i] + name[i + 1] + name[i] + name[i + 2:]
+    return name
+
+
+def timed(function, mentions):
+    started = time.perf_counter()
+    results = [function(mention) for mention in mentions]
+    return results, (time.perf_counter() - started) / len(mentions) * 1e6
+
+
+def run(extra_counts, lookups=500, seed=0):
+    rng = random.Random(seed)
+    with open(CARDS_PATH, "r", encoding="utf-8") as file:
+        base = json.load(file)["cards"]
+    print(f"{'cards':>6} {'targets':>8} {'indexed us':>11} {'brute us':>9} {'speedup':>8} {'agree':>7}")
+    for extra in extra_counts:
+        cards = dict(base)
+        cards.update(synthetic_cards(extra))
+        fuzzy = FuzzyIndex(cards)
+        names = list(cards)
+        mentions = [typo(rng.choice(names), rng) for _ in range(lookups)]
+        indexed, indexed_us = timed(fuzzy.lookup, mentions)
+        brute, brute_us = timed(lambda mention: brute_force(fuzzy, mention), mentions)
+        agree = sum(a == b for a, b in zip(indexed, brute)) / len(mentions)
+        print(
+            f"{len(cards):>6} {len(fuzzy.targets):>8} {indexed_us:>11.1f} {brute_us:>9.1f} "
+            f"{brute_us / indexed_us:>7.1f}x {agree:>7.1%}"
+        )
+
+
+if __name__ == "__main__":
+    run([int(count) for count in sys.argv[1:]] or [0, 150, 500, 1000])
@@ -0,0 +1,219 @@
+# Replay benchmark for the bot's processing path.
+#
+# Builds a BalatroBot around an in-process fake of Reddit and feeds a recorded
+# or synthetic comment corpus through it: the catch-up/stream hand-off, the
+# reply pipeline (or the sequential loop with --workers 0), the card database,
+# the rate limiter, reply coalescing, the metrics timers and a real responded
+# store, all with their state in a temporary directory. Reports throughput,
+# end-to-end reply latency, API writes (and how many coalescing saved), peak
+# RSS, per-stage timings and the responded store's disk traffic, and writes
+# them to a JSON file so runs can be compared. Run from the repository root:
+#
+#   python -m benchmarks.bench_replay --comments 20000 --mention-density 0.3
+#
+# A recorded corpus is a JSON-lines file with one {"body": ...} per line.
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from balatrobot import BalatroBot
+from benchmarks.fake_reddit import FakeComment, FakeReddit, FakeSubreddit
+from card_db import CardDatabaseWatcher
+from checkpoint import Checkpoint, catch_up_then_stream
+from metrics import instrument_stream, metrics
+from responded_store import AppendOnlyRespondedStore, TimedRespondedStore
+from retry_spool import RetrySpool
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+fillers = [
+    "What's the best way to use",
+    "I just lost to the boss blind again, any tips?",
+    "Honestly the shop never gives me",
+    "Ünïcödé spëlling and emoji 🃏✨ in the middle of a sentence",
+    "日本語のコメントもあります",
+    "Pretty sure that only works with",
+    "lol",
+]
+
+# Mentions that stress the [[...]] pattern and the matcher's fallbacks
+pathological = [
+    "[[" * 50 + "The Fool" + "]]" * 50,
+    "[[Blue[[Seal]]Deck]]",
+    "[[" + "x" * 2000 + "]]",
+    "[[]] [[ ]] [[$]] [[.]]",
+    "[[Ünïcödé]] [[🃏]] [[Straße]]",
+    "]]" * 100 + "[[" * 100,
+    "[[the]] [[of]] [[tag]]",
+]
+
+
+# Ways a user might write a card name
+def mention_variants(card_name):
+    words = card_name.split()
+    return [card_name, card_name.lower(), card_name.upper(), words[-1], words[0].lower()]
+
+
+def synthetic_corpus(count, mention_density, pathological_rate, card_names, seed):
+    rng = random.Random(seed)
+    bodies = []
+    for _ in range(count):
+        parts = [rng.choice(fillers)]
+        if rng.random() < mention_density:
+            for _ in range(rng.randint(1, 4)):
+                parts.append(f"[[{rng.choice(mention_variants(rng.choice(card_names)))}]]")
+        if rng.random() < pathological_rate:
+            parts.append(rng.choice(pathological))
+        bodies.append(" ".join(parts))
+    return bodies
+
+
+def recorded_corpus(path):
+    with open(path, "r", encoding="utf-8") as file:
+        return [json.loads(line)["body"] for line in file if line.strip()]
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100)[percent - 1]
+
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run(args):
+    with tempfile.TemporaryDirectory() as directory:
+        card_db_watcher = CardDatabaseWatcher(args.cards, os.path.join(directory, "cards.db"))
+        if args.corpus:
+            bodies = recorded_corpus(args.corpus)
+        else:
+            bodies = synthetic_corpus(
+                args.comments,
+                args.mention_density,
+                args.pathological_rate,
+                list(card_db_watcher.current.cards),
+                args.seed,
+            )
+        rng = random.Random(args.seed)
+        comments = [
+            FakeComment(
+                body,
+                latency=args.reply_latency / 1000,
+                submission_id=f"s{rng.randrange(args.submissions)}",
+            )
+            for body in bodies
+        ]
+        store = AppendOnlyRespondedStore(os.path.join(directory, "responded_comments.txt"))
+        bot = BalatroBot(
+            FakeReddit(FakeSubreddit(comments)),
+            card_db_watcher,
+            TimedRespondedStore(store, metrics),
+            RetrySpool(os.path.join(directory, "reply_spool.json")),
+            Checkpoint(os.path.join(directory, "checkpoint.json")),
+            merge_window=args.merge_window / 1000 if args.workers else 0.0,
+        )
+        stream = instrument_stream(catch_up_then_stream(bot.reddit.subreddit("balatro"), bot.checkpoint))
+        started = time.perf_counter()
+        if args.workers:
+            pipeline = bot.run_pipeline(stream, args.workers, args.queue_size)
+        else:
+            bot.run(stream)
+            pipeline = None
+        elapsed = time.perf_counter() - started
+        bot.close()
+        renderer = card_db_watcher.current.renderer
+
+        latencies = [
+            (comment.replies[-1].replied_at - comment.ingested) * 1000
+            for comment in comments
+            if comment.replies
+        ]
+        return {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": {
+                "comments": len(comments),
+                "corpus": args.corpus,
+                "mention_density": args.mention_density,
+                "pathological_rate": args.pathological_rate,
+                "workers": args.workers,
+                "queue_size": args.queue_size,
+                "reply_latency_ms": args.reply_latency,
+                "submissions": args.submissions,
+                "merge_window_ms": args.merge_window,
+                "seed": args.seed,
+            },
+            "elapsed_s": elapsed,
+            "comments_per_s": len(comments) / elapsed,
+            "replied_comments": sum(comment.id in store for comment in comments),
+            "api_writes": sum(len(comment.replies) for comment in comments),
+            "api_writes_saved": bot.coalescer.saved,
+            "backpressure_stalls": pipeline.stalls if pipeline is not None else 0,
+            "latency_ms": {
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+            },
+            "peak_rss_kb": peak_rss_kb(),
+            "store_bytes_written": store.bytes_written,
+            "store_bytes_read": store.bytes_read,
+            "reply_cache": {"hits": renderer.hits, "misses": renderer.misses},
+            "stages_ms": {
+                stage: total / count * 1000
+                for stage, (count, total, longest) in sorted(metrics.timers.items())
+            },
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a comment corpus through the bot")
+    parser.add_argument("--comments", type=int, default=20000, help="synthetic corpus size")
+    parser.add_argument("--corpus", help="recorded corpus (JSON lines with a body field)")
+    parser.add_argument("--mention-density", type=float, default=0.3, help="share of comments with mentions")
+    parser.add_argument("--pathological-rate", type=float, default=0.02, help="share of comments with odd [[...]] nesting")
+    parser.add_argument("--workers", type=int, default=4, help="reply workers (0 for the sequential loop)")
+    parser.add_argument("--queue-size", type=int, default=100)
+    parser.add_argument("--reply-latency", type=float, default=0.0, help="simulated reply latency in ms")
+    parser.add_argument("--submissions", type=int, default=50, help="threads the comments are spread over")
+    parser.add_argument("--merge-window", type=float, default=0.0, help="coalescing window in ms")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cards", default="cards.json")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    # Backpressure is expected when replaying as fast as possible
+    logging.getLogger("pipeline").setLevel(logging.ERROR)
+    results = run(args)
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=4)
+    latency = results["latency_ms"]
+    if latency["p50"] is None:
+        # Nothing was answered, so there is no latency to report
+        latency = "latency n/a"
+    else:
+        latency = f"latency p50/p95/p99 {latency['p50']:.2f}/{latency['p95']:.2f}/{latency['p99']:.2f}ms"
+    print(
+        f"{results['comments_per_s']:.0f} comments/s, {results['replied_comments']} comments answered, "
+        f"{latency}, "
+        f"peak RSS {results['peak_rss_kb']}KB, store wrote {results['store_bytes_written']}B"
+    )
+    print(f"{results['api_writes']} API writes, {results['api_writes_saved']} saved by coalescing")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# Multi-process check for sharding and the shared SQLite responded store.
+#
+# Starts several worker processes that all read the same fake comment stream
+# and share one SQLiteRespondedStore, then counts how many comments were
+# answered more than once (which should always be zero). With --no-shard every
+# worker sees every comment, so only the claims keep them apart. Run from the
+# repository root:
+#
+#   python -m benchmarks.bench_shards --processes 4
+import argparse
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from collections import Counter
+
+from balatrobot import BalatroBot
+from benchmarks.bench_replay import synthetic_corpus
+from benchmarks.fake_reddit import FakeComment, FakeReddit, FakeSubreddit
+from card_db import CardDatabaseWatcher
+from checkpoint import Checkpoint
+from metrics import metrics
+from responded_store import SQLiteRespondedStore, TimedRespondedStore
+from retry_spool import RetrySpool
+from sharding import shard_comments
+
+
+def worker(args, directory, shard_index, results):
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("pipeline").setLevel(logging.ERROR)
+    card_db_watcher = CardDatabaseWatcher(args.cards, os.path.join(directory, f"cards-{shard_index}.db"))
+    bodies = synthetic_corpus(
+        args.comments, args.mention_density, 0.0, list(card_db_watcher.current.cards), args.seed
+    )
+    # Same IDs in every process, as if they were all reading the same subreddit
+    comments = [
+        FakeComment(body, comment_id=f"c{i:06d}", latency=args.reply_latency / 1000)
+        for i, body in enumerate(bodies)
+    ]
+    store = SQLiteRespondedStore(os.path.join(directory, "responded_comments.db"), import_path=None)
+    bot = BalatroBot(
+        FakeReddit(FakeSubreddit(comments)),
+        card_db_watcher,
+        TimedRespondedStore(store, metrics),
+        RetrySpool(os.path.join(directory, f"reply_spool-{shard_index}.json")),
+        Checkpoint(os.path.join(directory, f"checkpoint-{shard_index}.json")),
+    )
+    stream = bot.reddit.subreddit("balatro").stream.comments()
+    if not args.no_shard:
+        stream = shard_comments(stream, shard_index, args.processes)
+    bot.run_pipeline(stream, args.workers)
+    bot.close()
+    results.put([comment.id for comment in comments if comment.replies])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run several bot workers against one shared store")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--comments", type=int, default=5000)
+    parser.add_argument("--mention-density", type=float, default=0.5)
+    parser.add_argument("--workers", type=int, default=4, help="reply workers per process")
+    parser.add_argument("--reply-latency", type=float, default=1.0, help="simulated reply latency in ms")
+    parser.add_argument("--no-shard", action="store_true", help="every process sees every comment")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cards", default="cards.json")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=worker, args=(args, directory, shard_index, results))
+            for shard_index in range(args.processes)
+        ]
+        started = time.perf_counter()
+        for process in processes:
+            process.start()
+        replied = Counter()
+        for _ in processes:
+            replied.update(results.get())
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - started
+
+    duplicates = sum(1 for count in replied.values() if count > 1)
+    print(
+        f"{args.processes} processes answered {len(replied)} comments "
+        f"({sum(replied.values())} replies) in {elapsed:.2f}s, "
+        f"{args.comments / elapsed:.0f} comments/s, {duplicates} answered more than once"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# In-process stand-ins for the parts of PRAW the bot uses, so its processing
+# path can be driven without credentials or network access.
+import itertools
+import threading
+import time
+
+comment_ids = itertools.count(1)
+
+
+def next_comment_id():
+    return f"f{next(comment_ids):06x}"
+
+
+class FakeComment:
+    def __init__(self, body, comment_id=None, created_utc=None, latency=0.0, submission_id="s1"):
+        self.id = comment_id or next_comment_id()
+        self.fullname = f"t1_{self.id}"
+        self.body = body
+        self.created_utc = created_utc if created_utc is not None else time.time()
+        self.submission_id = submission_id
+        self.link_id = f"t3_{submission_id}"
+        self.permalink = f"/r/fake/comments/{submission_id}/_/{self.id}/"
+        self.latency = latency
+        # Set by the fake stream when the comment is handed to the bot
+        self.ingested = None
+        self.replies = []
+        self.lock = threading.Lock()
+
+    # Record the reply (after the simulated network latency) and return the
+    # new comment, like praw's Comment.reply
+    def reply(self, body):
+        if self.latency:
+            time.sleep(self.latency)
+        reply = FakeComment(body, latency=self.latency, submission_id=self.submission_id)
+        reply.replied_at = time.perf_counter()
+        with self.lock:
+            self.replies.append(reply)
+        return reply
+
+
+class FakeStream:
+    def __init__(self, subreddit):
+        self.subreddit = subreddit
+
+    # Yields the recent history and then the comments "posted" afterwards,
+    # like praw's stream, stopping once there is nothing left
+    def comments(self):
+        for comment in itertools.chain(self.subreddit.history[-100:], self.subreddit.incoming):
+            comment.ingested = time.perf_counter()
+            yield comment
+
+
+class FakeSubreddit:
+    def __init__(self, incoming, history=()):
+        self.history = list(history)
+        self.incoming = incoming
+        self.stream = FakeStream(self)
+
+    # Newest first, like the /comments listing
+    def comments(self, limit=100):
+        return iter(list(reversed(self.history))[:limit])
+
+
+class FakeAuth:
+    def __init__(self, quota):
+        self.quota = quota
+        self.reset_timestamp = time.time() + 600
+
+    # An API quota that never runs out, in the shape praw reports it
+    @property
+    def limits(self):
+        return {"remaining": self.quota, "used": 0, "reset_timestamp": self.reset_timestamp}
+
+
+# Stands in for praw.Reddit: one subreddit, whatever name is asked for
+class FakeReddit:
+    def __init__(self, subreddit, quota=10 ** 9):
+        self.auth = FakeAuth(quota)
+        self.fake_subreddit = subreddit
+
+    def subreddit(self, name):
+        return self.fake_subreddit
+
+    def comment(self, comment_id):
+        for comment in itertools.chain(self.fake_subreddit.history, self.fake_subreddit.incoming):
+            if comment.id == comment_id:
+                return comment
+        raise KeyError(comment_id)
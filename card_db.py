@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+import pickle
+import sys
+import threading
+import time
+
+from matcher import CardIndex
+from renderer import ReplyRenderer, render_card
+
+logger = logging.getLogger(__name__)
+
+# Versioned card data, edited by hand
+CARDS_PATH = "cards.json"
+# Precompiled form of the card data, rebuilt whenever cards.json changes
+ARTIFACT_PATH = "cards.db"
+# Bump when the layout of the artifact (or anything pickled into it) changes
+ARTIFACT_VERSION = 3
+
+
+# Everything derived from one version of the card data. The bot swaps in a
+# whole new CardDatabase on reload, so a comment is always matched and
+# rendered against the same version.
+class CardDatabase:
+    def __init__(self, cards, version, index=None, blocks=None):
+        self.cards = cards
+        self.version = version
+        self.index = index if index is not None else CardIndex(cards)
+        if blocks is None:
+            blocks = {
+                card_name: render_card(card_name, card_info)
+                for card_name, card_info in cards.items()
+            }
+        self.blocks = blocks
+        self.renderer = ReplyRenderer(cards, blocks=blocks)
+
+
+# Identifies one revision of the source file without reading it
+def source_stamp(source_path):
+    stat = os.stat(source_path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+# Parse cards.json and write the precompiled artifact next to it
+def build_artifact(source_path=CARDS_PATH, artifact_path=ARTIFACT_PATH):
+    stamp = source_stamp(source_path)
+    with open(source_path, "r", encoding="utf-8") as file:
+        data = json.load(file)
+    card_db = CardDatabase(data["cards"], data["version"])
+    artifact = {
+        "artifact_version": ARTIFACT_VERSION,
+        "source_stamp": stamp,
+        "version": card_db.version,
+        "cards": card_db.cards,
+        "index": card_db.index,
+        "blocks": card_db.blocks,
+    }
+    try:
+        temp_path = artifact_path + ".tmp"
+        with open(temp_path, "wb") as file:
+            pickle.dump(artifact, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, artifact_path)
+    except OSError as e:
+        logger.warning(f"Could not write card artifact {artifact_path}: {e}")
+    return card_db
+
+
+# Load the card database, from the artifact if it is current for the source
+def load_card_db(source_path=CARDS_PATH, artifact_path=ARTIFACT_PATH):
+    stamp = source_stamp(source_path)
+    try:
+        with open(artifact_path, "rb") as file:
+            artifact = pickle.loads(file.read())
+        if (
+            artifact["artifact_version"] == ARTIFACT_VERSION
+            and artifact["source_stamp"] == stamp
+        ):
+            return CardDatabase(
+                artifact["cards"],
+                artifact["version"],
+                index=artifact["index"],
+                blocks=artifact["blocks"],
+            )
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable card artifact {artifact_path}: {e}")
+    logger.info(f"Building card artifact {artifact_path} from {source_path}")
+    return build_artifact(source_path, artifact_path)
+
+
+# Keeps the current CardDatabase, reloading it when cards.json changes on disk.
+# The new database is built off to the side and swapped in with a single
+# assignment, so the stream carries on uninterrupted.
+class CardDatabaseWatcher:
+    def __init__(self, source_path=CARDS_PATH, artifact_path=ARTIFACT_PATH, interval=30):
+        self.source_path = source_path
+        self.artifact_path = artifact_path
+        self.interval = interval
+        self.stamp = source_stamp(source_path)
+        self.current = load_card_db(source_path, artifact_path)
+
+    # Reload if the source changed; returns True if a new version was swapped in
+    def check(self):
+        stamp = source_stamp(self.source_path)
+        if stamp == self.stamp:
+            return False
+        # Remember the stamp even if loading fails, so a broken edit is
+        # reported once rather than on every check
+        self.stamp = stamp
+        try:
+            card_db = load_card_db(self.source_path, self.artifact_path)
+        except Exception as e:
+            logger.error(f"Failed to reload {self.source_path}, keeping the current cards: {e}")
+            return False
+        self.current = card_db
+        logger.info(f"Reloaded {len(card_db.cards)} cards (version {card_db.version})")
+        return True
+
+    # Poll the source in a background thread
+    def start(self):
+        def run():
+            while True:
+                time.sleep(self.interval)
+                try:
+                    self.check()
+                except Exception as e:
+                    logger.error(f"An error occurred while checking {self.source_path}: {e}")
+
+        thread = threading.Thread(target=run, name="card-db-watcher", daemon=True)
+        thread.start()
+        return thread
+
+
+# Build step: python card_db.py [cards.json] [cards.db]
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    started = time.perf_counter()
+    card_db = build_artifact(*sys.argv[1:3])
+    elapsed = time.perf_counter() - started
+    logger.info(f"Built {len(card_db.cards)} cards (version {card_db.version}) in {elapsed * 1000:.1f}ms")
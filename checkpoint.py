@@ -0,0 +1,133 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+# Newest comment the bot has finished with, kept on disk so a restart knows
+# where to pick up from. Saves are batched; losing the last few updates only
+# means a few comments get looked at again, and the responded store still
+# stops them from being answered twice.
+#
+# When comments are handled out of order (by the reply pipeline), each one is
+# registered with begin() as it is read. The checkpoint then only moves up to
+# the oldest comment still in flight, so a restart never skips a comment whose
+# reply is still queued.
+class Checkpoint:
+    def __init__(self, path="checkpoint.json", save_every=50, save_interval=30):
+        self.path = path
+        self.save_every = save_every
+        self.save_interval = save_interval
+        self.fullname = None
+        self.created_utc = 0.0
+        self.unsaved = 0
+        self.last_save = time.monotonic()
+        self.lock = threading.Lock()
+        # fullname -> [comment, finished], in the order the comments were read
+        self.in_flight = OrderedDict()
+        if os.path.exists(path):
+            with open(path, "r") as file:
+                data = json.load(file)
+            self.fullname = data["fullname"]
+            self.created_utc = data["created_utc"]
+            logger.info(f"Loaded checkpoint {self.fullname} from {path}")
+
+    # Record that a comment has been read but not dealt with yet
+    def begin(self, comment):
+        with self.lock:
+            self.in_flight[comment.fullname] = [comment, False]
+
+    # Record that a comment has been dealt with
+    def advance(self, comment):
+        with self.lock:
+            entry = self.in_flight.get(comment.fullname)
+            if entry is None:
+                self._move_to(comment)
+                return
+            entry[1] = True
+            while self.in_flight:
+                oldest, finished = next(iter(self.in_flight.values()))
+                if not finished:
+                    break
+                self.in_flight.popitem(last=False)
+                self._move_to(oldest)
+
+    def _move_to(self, comment):
+        if comment.created_utc < self.created_utc:
+            return
+        self.fullname = comment.fullname
+        self.created_utc = comment.created_utc
+        self.unsaved += 1
+        if (
+            self.unsaved >= self.save_every
+            or time.monotonic() - self.last_save >= self.save_interval
+        ):
+            self._save()
+
+    def _save(self):
+        if self.fullname is None:
+            return
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as file:
+            json.dump({"fullname": self.fullname, "created_utc": self.created_utc}, file)
+        os.replace(temp_path, self.path)
+        self.unsaved = 0
+        self.last_save = time.monotonic()
+
+    def save(self):
+        with self.lock:
+            self._save()
+
+
+# Fetch the comments posted since the checkpoint, oldest first.
+#
+# The listing is paged newest first, 100 comments per request, until it
+# reaches the checkpoint (or runs out after limit comments, which Reddit caps
+# at about 1000 anyway).
+def catch_up(subreddit, checkpoint, limit=1000):
+    if checkpoint.fullname is None:
+        return []
+    started = time.monotonic()
+    comments = []
+    reached = False
+    for comment in subreddit.comments(limit=limit):
+        if (
+            comment.fullname == checkpoint.fullname
+            or comment.created_utc < checkpoint.created_utc
+        ):
+            reached = True
+            break
+        comments.append(comment)
+    comments.reverse()
+    elapsed = time.monotonic() - started
+    logger.info(f"Recovered {len(comments)} comments since the checkpoint in {elapsed:.1f}s")
+    if not reached:
+        logger.warning(
+            f"Did not reach checkpoint {checkpoint.fullname}, older comments may have been missed"
+        )
+    return comments
+
+
+# Yield the comments missed since the checkpoint, then the live stream,
+# without repeating anything the catch-up pass already covered
+def catch_up_then_stream(subreddit, checkpoint, limit=1000):
+    boundary = checkpoint.created_utc
+    started = time.monotonic()
+    recovered = catch_up(subreddit, checkpoint, limit)
+    seen = set()
+    for comment in recovered:
+        seen.add(comment.id)
+        yield comment
+    if recovered:
+        elapsed = time.monotonic() - started
+        logger.info(
+            f"Caught up on {len(recovered)} comments in {elapsed:.1f}s, switching to the live stream"
+        )
+    for comment in subreddit.stream.comments():
+        if comment.id in seen or comment.created_utc < boundary:
+            continue
+        yield comment
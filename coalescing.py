@@ -0,0 +1,258 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+REDDIT_URL = "https://www.reddit.com"
+
+
+# Submission a comment belongs to ("t3_..."), known without fetching anything
+def submission_of(comment):
+    return comment.link_id
+
+
+# Cards the bot has already explained in each submission, with a link to the
+# reply that explained them.
+#
+# Submissions are kept in least recently used order and the oldest are dropped
+# past max_threads. An explanation older than ttl seconds no longer counts,
+# since by then it has likely scrolled out of sight.
+class ThreadIndex:
+    def __init__(self, max_threads=1000, ttl=6 * 3600):
+        self.max_threads = max_threads
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # submission ID -> {card name: (permalink, when it was explained)}
+        self.threads = OrderedDict()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.threads)
+
+    # Return {card name: permalink} for the cards explained in a submission
+    def covered(self, submission_id):
+        cutoff = time.monotonic() - self.ttl
+        with self.lock:
+            cards = self.threads.get(submission_id)
+            if cards is None:
+                return {}
+            cards = {
+                card_name: entry
+                for card_name, entry in cards.items()
+                if entry[1] >= cutoff
+            }
+            if cards:
+                self.threads[submission_id] = cards
+            else:
+                del self.threads[submission_id]
+            return {card_name: permalink for card_name, (permalink, _) in cards.items()}
+
+    # Record that a reply at permalink explained card_names
+    def record(self, submission_id, card_names, permalink):
+        now = time.monotonic()
+        with self.lock:
+            cards = self.threads.setdefault(submission_id, {})
+            for card_name in card_names:
+                cards[card_name] = (permalink, now)
+            self.threads.move_to_end(submission_id)
+            while len(self.threads) > self.max_threads:
+                self.threads.popitem(last=False)
+
+
+# Mentions in one submission waiting to be answered together
+class Batch:
+    def __init__(self, comment, response, done=None, deadline=0.0):
+        self.comments = []
+        self.responses = []
+        self.callbacks = []
+        self.card_names = []
+        # API writes the comments would take if each got its own full reply
+        self.writes = 0
+        self.deadline = deadline
+        self.add(comment, response, done)
+
+    def add(self, comment, response, done=None):
+        self.comments.append(comment)
+        self.responses.append(response)
+        self.card_names.extend(response.card_names)
+        self.writes += len(response)
+        if done is not None:
+            self.callbacks.append(done)
+
+
+# Reply sink that avoids repeating the bot within a submission.
+#
+# Cards already explained in the submission (per the ThreadIndex) are only
+# linked to, and a comment whose cards are all covered gets no reply at all.
+# Replies within a submission go out one at a time, so each one sees what the
+# one before it explained.
+#
+# reply(comment, response) answers a comment straight away, with the same
+# contract as a plain reply sink. collect(comment, response, done) instead
+# adds the comment to its submission's batch and returns at once: a batch
+# stays open for window seconds, mentions arriving in the same submission
+# meanwhile join it, and then a scheduler thread hands it to one of senders
+# threads, which answers the whole batch with one reply to its first comment
+# and calls each comment's done(error). At most max_batches batches wait at a
+# time; past that collect() blocks, which backs up the stream.
+class ReplyCoalescer:
+    def __init__(
+        self,
+        render,
+        send,
+        thread_index=None,
+        window=0.0,
+        senders=4,
+        max_batches=100,
+        metrics=None,
+    ):
+        # render(card_names, links) -> reply parts; send(comment, parts) -> the
+        # first reply posted
+        self.render = render
+        self.send = send
+        self.thread_index = thread_index if thread_index is not None else ThreadIndex()
+        self.window = window
+        self.senders = senders
+        self.metrics = metrics
+        self.lock = threading.Condition()
+        # Open batches by submission, and submissions with a reply going out
+        self.pending = {}
+        self.sending = set()
+        self.slots = threading.BoundedSemaphore(max_batches)
+        self.unfinished = 0
+        self.flushing = False
+        self.executor = None
+        self.writes = 0
+        self.saved = 0
+
+    # Answer one comment now; raises if the reply failed
+    def reply(self, comment, response):
+        self._answer(submission_of(comment), Batch(comment, response))
+
+    # Add a comment to its submission's batch, to be answered within window
+    # seconds; done(error) is called once it is (error is None on success)
+    def collect(self, comment, response, done):
+        submission_id = submission_of(comment)
+        with self.lock:
+            batch = self.pending.get(submission_id)
+            if batch is not None:
+                batch.add(comment, response, done)
+                return
+        self.slots.acquire()
+        with self.lock:
+            batch = self.pending.get(submission_id)
+            if batch is not None:
+                self.slots.release()
+                batch.add(comment, response, done)
+                return
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(self.senders, thread_name_prefix="coalescer")
+                threading.Thread(target=self._schedule, name="coalescer", daemon=True).start()
+            deadline = time.monotonic() + (0 if self.flushing else self.window)
+            self.pending[submission_id] = Batch(comment, response, done, deadline)
+            self.unfinished += 1
+            self.lock.notify_all()
+
+    # Send every open batch now, and any opened from here on straight away
+    def flush(self):
+        with self.lock:
+            self.flushing = True
+            for batch in self.pending.values():
+                batch.deadline = 0
+            self.lock.notify_all()
+
+    # Wait until every collected comment has been answered, or timeout passes;
+    # returns True if they all were
+    def wait(self, timeout=None):
+        with self.lock:
+            return self.lock.wait_for(lambda: self.unfinished == 0, timeout)
+
+    # Hand batches whose window has closed to the senders
+    def _schedule(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                due = [
+                    (submission_id, batch)
+                    for submission_id, batch in self.pending.items()
+                    if batch.deadline <= now
+                ]
+                if not due:
+                    deadlines = [batch.deadline for batch in self.pending.values()]
+                    self.lock.wait(min(deadlines) - now if deadlines else None)
+                    continue
+                for submission_id, _ in due:
+                    del self.pending[submission_id]
+            for submission_id, batch in due:
+                self.executor.submit(self._send_batch, submission_id, batch)
+
+    def _send_batch(self, submission_id, batch):
+        error = None
+        try:
+            self._answer(submission_id, batch)
+        except Exception as e:
+            error = e
+        finally:
+            self.slots.release()
+        for done in batch.callbacks:
+            try:
+                done(error)
+            except Exception as e:
+                logger.error(f"An error occurred while finishing a coalesced reply: {e}")
+        with self.lock:
+            self.unfinished -= 1
+            self.lock.notify_all()
+
+    def _answer(self, submission_id, batch):
+        with self.lock:
+            self.lock.wait_for(lambda: submission_id not in self.sending)
+            self.sending.add(submission_id)
+        try:
+            writes = self._answer_batch(submission_id, batch)
+        finally:
+            with self.lock:
+                self.sending.discard(submission_id)
+                self.lock.notify_all()
+        saved = batch.writes - writes
+        with self.lock:
+            self.writes += writes
+            self.saved += saved
+        if self.metrics is not None and saved > 0:
+            self.metrics.inc("api_writes_saved_total", saved)
+
+    # Post the batch's reply and return how many parts it took
+    def _answer_batch(self, submission_id, batch):
+        covered = self.thread_index.covered(submission_id)
+        card_names = list(dict.fromkeys(batch.card_names))
+        new_card_names = [card_name for card_name in card_names if card_name not in covered]
+        if not new_card_names:
+            logger.info(
+                f"Cards mentioned in {batch.comments[0].id} were already explained in {submission_id}"
+            )
+            return 0
+        links = tuple(
+            (card_name, covered[card_name])
+            for card_name in card_names
+            if card_name in covered
+        )
+        if len(batch.comments) == 1 and not links:
+            # Nothing to merge or link, so the reply rendered by the matcher stands
+            parts = batch.responses[0]
+        else:
+            parts = self.render(new_card_names, links)
+        if len(batch.comments) > 1:
+            logger.info(
+                f"Answering {len(batch.comments)} comments in {submission_id} with one reply"
+            )
+        reply = self.send(batch.comments[0], parts)
+        if reply is None:
+            # Posted, but Reddit didn't send the reply back, so there is no
+            # permalink to point later mentions at
+            logger.info(f"No permalink came back for the reply in {submission_id}")
+            return len(parts)
+        # Only the cards the reply actually explains, not any it had to leave out
+        self.thread_index.record(submission_id, parts.card_names, REDDIT_URL + reply.permalink)
+        return len(parts)
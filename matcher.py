@@ -0,0 +1,221 @@
+import heapq
+import math
+import re
+from collections import Counter
+
+# Pattern used to find [[card name]] mentions in a comment
+mention_pattern = re.compile(r"\[\[(.*?)\]\]")
+
+
+# Word characters as understood by the regex \b boundary
+def is_word_char(char):
+    return char.isalnum() or char == "_"
+
+
+non_word_pattern = re.compile(r"[\W_]+")
+
+
+# Lowercase a name or mention and reduce punctuation to single spaces
+def normalize(text):
+    return " ".join(non_word_pattern.split(text.lower())).strip()
+
+
+# Character trigrams of a normalized string, padded so that the first and last
+# letters count as much as the middle ones
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# Edit distance between two strings, or None if it is more than max_distance.
+# Only cells within max_distance of the diagonal can stay under the bound, so
+# only those are computed.
+def bounded_levenshtein(first, second, max_distance):
+    if abs(len(first) - len(second)) > max_distance:
+        return None
+    too_far = max_distance + 1
+    previous = [min(j, too_far) for j in range(len(second) + 1)]
+    for i, first_char in enumerate(first, 1):
+        low = max(1, i - max_distance)
+        high = min(len(second), i + max_distance)
+        current = [too_far] * (len(second) + 1)
+        current[0] = min(i, too_far)
+        for j in range(low, high + 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (first_char != second[j - 1]),
+            )
+        if min(current[low - 1:high + 1]) > max_distance:
+            return None
+        previous = current
+    if previous[-1] > max_distance:
+        return None
+    return previous[-1]
+
+
+# Typo-tolerant lookup for mentions the exact index misses.
+#
+# Targets are the same word spans CardIndex uses ("cerulean bell", "cerulean",
+# "bell", ...), normalized. Each target is filed under its character trigrams,
+# so a lookup only touches targets sharing a trigram with the mention, skipping
+# trigrams so common they would pull in most of the index. The few targets
+# with the best trigram overlap are then checked with a bounded edit distance,
+# and the closest one wins if it is similar enough (ties go to the earlier
+# card, as with exact matches). Mentions shorter than min_length are too
+# ambiguous to guess at: one edit away from "hand" or "seeds" is mostly
+# ordinary words that happen to sit in a card name.
+class FuzzyIndex:
+    def __init__(
+        self,
+        card_names,
+        threshold=0.8,
+        candidates=8,
+        min_length=6,
+        common_gram_share=0.1,
+    ):
+        self.names = list(card_names)
+        self.threshold = threshold
+        self.candidates = candidates
+        self.min_length = min_length
+        self.targets = []
+        self.gram_counts = []
+        self.postings = {}
+        # Shortest target a mention of min_length can still be similar enough to
+        target_min_length = math.ceil(min_length * threshold)
+        seen = set()
+        for position, name in enumerate(self.names):
+            words = normalize(name).split()
+            for start in range(len(words)):
+                for end in range(start + 1, len(words) + 1):
+                    text = " ".join(words[start:end])
+                    if len(text) < target_min_length or text in seen:
+                        continue
+                    seen.add(text)
+                    grams = trigrams(text)
+                    for gram in grams:
+                        self.postings.setdefault(gram, []).append(len(self.targets))
+                    self.targets.append((text, position))
+                    self.gram_counts.append(len(grams))
+        self.common_gram_limit = max(50, int(len(self.targets) * common_gram_share))
+
+    # Return the closest card name to a misspelled mention, or None
+    def lookup(self, card_name):
+        text = normalize(card_name)
+        if len(text) < self.min_length:
+            return None
+        grams = trigrams(text)
+        postings = [self.postings[gram] for gram in grams if gram in self.postings]
+        rare = [posting for posting in postings if len(posting) <= self.common_gram_limit]
+        shared = Counter()
+        for posting in rare or postings:
+            shared.update(posting)
+        # Dice coefficient of the trigram sets, best first
+        ranked = heapq.nlargest(
+            self.candidates,
+            shared.items(),
+            key=lambda item: 2 * item[1] / (len(grams) + self.gram_counts[item[0]]),
+        )
+        best = None
+        for target_id, _ in ranked:
+            target, position = self.targets[target_id]
+            longest = max(len(text), len(target))
+            # (the epsilon stops float rounding from shaving off an edit)
+            max_distance = int(longest * (1 - self.threshold) + 1e-9)
+            distance = bounded_levenshtein(text, target, max_distance)
+            if distance is None:
+                continue
+            score = (1 - distance / longest, -position)
+            if best is None or score > best:
+                best = score
+        if best is None:
+            return None
+        return self.names[-best[1]]
+
+
+# Index over the card names, built once per card database.
+#
+# A mention matches a card name when it appears in the name (ignoring case)
+# with a word boundary on both sides, and the first matching name in
+# dictionary order wins. For a mention that starts and ends with a word
+# character, every possible match runs from the start of one word of the name
+# to the end of the same or a later word, so all of those spans are stored in
+# a dict pointing at the first name that contains them. Anything else falls
+# back to the original regex scan. Mentions that match nothing get a second
+# chance through the FuzzyIndex.
+class CardIndex:
+    def __init__(self, card_names):
+        self.names = list(card_names)
+        self.fuzzy = FuzzyIndex(self.names)
+        self.spans = {}
+        # Names the ASCII lower() shortcut can't be trusted for, checked with
+        # the regex instead (regex case folding treats some non-ASCII letters
+        # as equal to ASCII ones)
+        self.irregular = []
+        for position, name in enumerate(self.names):
+            if not name.isascii():
+                self.irregular.append(position)
+                continue
+            lowered = name.lower()
+            starts, ends = self._word_runs(lowered)
+            for start in starts:
+                for end in ends:
+                    if end > start:
+                        self.spans.setdefault(lowered[start:end], position)
+
+    # Start and end offsets of each run of word characters in a name
+    @staticmethod
+    def _word_runs(name):
+        starts = []
+        ends = []
+        previous = False
+        for offset, char in enumerate(name):
+            current = is_word_char(char)
+            if current and not previous:
+                starts.append(offset)
+            elif previous and not current:
+                ends.append(offset)
+            previous = current
+        if previous:
+            ends.append(len(name))
+        return starts, ends
+
+    @staticmethod
+    def _regex_match(card_name, key):
+        return re.search(r"\b" + re.escape(card_name) + r"\b", key, re.IGNORECASE)
+
+    def _scan(self, card_name, positions):
+        for position in positions:
+            if self._regex_match(card_name, self.names[position]):
+                return self.names[position]
+        return None
+
+    # Return the first card name matching the mention, or None
+    def lookup(self, card_name):
+        if not (
+            card_name
+            and card_name.isascii()
+            and is_word_char(card_name[0])
+            and is_word_char(card_name[-1])
+        ):
+            return self._scan(card_name, range(len(self.names)))
+        position = self.spans.get(card_name.lower())
+        for irregular in self.irregular:
+            if position is not None and irregular > position:
+                break
+            if self._regex_match(card_name, self.names[irregular]):
+                return self.names[irregular]
+        if position is None:
+            return None
+        return self.names[position]
+
+    # Return the matching card names for every [[...]] mention in a comment
+    def extract(self, comment_body):
+        matched_card_names = []
+        for card_name in mention_pattern.findall(comment_body):
+            key = self.lookup(card_name)
+            if key is None:
+                key = self.fuzzy.lookup(card_name)
+            if key is not None:
+                matched_card_names.append(key)
+        return matched_card_names
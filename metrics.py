@@ -0,0 +1,242 @@
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "balatrobot"
+
+
+def label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+# A counter or gauge value, exactly: whole numbers without a decimal point or
+# exponent, anything else with every digit repr() gives it
+def value_text(value):
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, float) and value.is_integer() and abs(value) < 2 ** 53:
+        value = int(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+# Counters, per-stage timers and gauges for the bot's hot path.
+#
+# Everything is kept in plain dicts behind one lock; recording a value is a
+# dict update, so instrumentation stays cheap enough to leave on. Gauges can
+# be callables, read only when the metrics are rendered.
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = collections.defaultdict(float)
+        # stage -> [count, total seconds, max seconds]
+        self.timers = {}
+        self.gauges = {}
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += amount
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            timer = self.timers.setdefault(stage, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    # Time the body of a with block as one run of a stage
+    @contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    # Set a gauge to a value, or to a callable returning the value
+    def gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def error(self, exception):
+        self.inc("errors_total", type=type(exception).__name__)
+
+    def _gauge_values(self):
+        with self.lock:
+            gauges = dict(self.gauges)
+        values = {}
+        for name, value in gauges.items():
+            try:
+                value = value() if callable(value) else value
+            except Exception:
+                value = None
+            if value is not None:
+                values[name] = value
+        return values
+
+    # Prometheus text exposition format
+    def render(self):
+        with self.lock:
+            counters = dict(self.counters)
+            timers = {stage: list(timer) for stage, timer in self.timers.items()}
+        lines = []
+        seen = set()
+        for (name, labels), value in sorted(counters.items()):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# TYPE {PREFIX}_{name} counter")
+            lines.append(f"{PREFIX}_{name}{label_text(labels)} {value_text(value)}")
+        if timers:
+            lines.append(f"# TYPE {PREFIX}_stage_seconds summary")
+            for stage, (count, total, longest) in sorted(timers.items()):
+                lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {count}')
+                lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f"# TYPE {PREFIX}_stage_seconds_max gauge")
+            for stage, (count, total, longest) in sorted(timers.items()):
+                lines.append(f'{PREFIX}_stage_seconds_max{{stage="{stage}"}} {longest:.6f}')
+        for name, value in sorted(self._gauge_values().items()):
+            lines.append(f"# TYPE {PREFIX}_{name} gauge")
+            lines.append(f"{PREFIX}_{name} {value_text(value)}")
+        return "\n".join(lines) + "\n"
+
+    # One log line with the headline numbers
+    def summary(self):
+        with self.lock:
+            counters = dict(self.counters)
+            timers = {stage: list(timer) for stage, timer in self.timers.items()}
+        totals = collections.defaultdict(float)
+        for (name, labels), value in counters.items():
+            totals[name] += value
+        parts = [f"{name}={value_text(value)}" for name, value in sorted(totals.items())]
+        for stage, (count, total, longest) in sorted(timers.items()):
+            parts.append(f"{stage}={total / count * 1000:.2f}ms avg/{longest * 1000:.0f}ms max")
+        for name, value in sorted(self._gauge_values().items()):
+            parts.append(f"{name}={value_text(value)}")
+        return "Metrics: " + ", ".join(parts)
+
+    # Log the summary line every interval seconds
+    def start_summary_log(self, interval=300):
+        def run():
+            while True:
+                time.sleep(interval)
+                logger.info(self.summary())
+
+        thread = threading.Thread(target=run, name="metrics-summary", daemon=True)
+        thread.start()
+        return thread
+
+    # Serve the metrics at http://host:port/metrics
+    def serve(self, port, host="127.0.0.1"):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+        thread.start()
+        logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+        return server
+
+
+# Shared registry for the whole bot
+metrics = Metrics()
+
+
+# Pass a comment stream through, timing the wait for each comment (ingest)
+# and tracking how far behind the stream is
+def instrument_stream(comments, metrics=metrics):
+    iterator = iter(comments)
+    while True:
+        started = time.perf_counter()
+        try:
+            comment = next(iterator)
+        except StopIteration:
+            return
+        except Exception as e:
+            metrics.error(e)
+            raise
+        metrics.observe("ingest", time.perf_counter() - started)
+        metrics.inc("comments_total")
+        metrics.gauge("stream_lag_seconds", max(time.time() - comment.created_utc, 0))
+        yield comment
+
+
+# Sampling profiler, started and stopped at runtime (e.g. from a signal).
+#
+# While running, a background thread records the stack of every other thread
+# each interval seconds; stopping it logs the hottest stacks and writes all of
+# them in collapsed form ("a;b;c count", as used by flame graph tools). When
+# it isn't running it costs nothing.
+class SamplingProfiler:
+    def __init__(self, interval=0.005, output_dir="."):
+        self.interval = interval
+        self.output_dir = output_dir
+        self.samples = collections.Counter()
+        self.running = threading.Event()
+        self.thread = None
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        while self.running.is_set():
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = ";".join(
+                    f"{summary.name} ({os.path.basename(summary.filename)}:{summary.lineno})"
+                    for summary in traceback.extract_stack(frame)
+                )
+                self.samples[stack] += 1
+            time.sleep(self.interval)
+
+    def start(self):
+        self.samples.clear()
+        self.running.set()
+        self.thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+        self.thread.start()
+        logger.info("Sampling profiler started")
+
+    def stop(self):
+        self.running.clear()
+        self.thread.join()
+        self.thread = None
+        path = os.path.join(self.output_dir, f"profile-{time.strftime('%Y%m%d-%H%M%S')}.txt")
+        with open(path, "w") as file:
+            for stack, count in self.samples.most_common():
+                file.write(f"{stack} {count}\n")
+        total = sum(self.samples.values())
+        logger.info(f"Sampling profiler stopped, {total} samples written to {path}")
+        # Hottest innermost frames
+        leaves = collections.Counter()
+        for stack, count in self.samples.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        for leaf, count in leaves.most_common(5):
+            logger.info(f"{count / total:6.1%} {leaf}")
+
+    def toggle(self, *args):
+        if self.running.is_set():
+            self.stop()
+        else:
+            self.start()
@@ -0,0 +1,214 @@
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of the stream as it passes through the queues
+STOP = object()
+
+
+# Default reply sink: post the reply parts on Reddit, each part replying to
+# the one before it. Returns the first reply posted (None if Reddit didn't
+# send it back).
+def send_reply(comment, response):
+    first = None
+    parent = comment
+    for index, part in enumerate(response):
+        reply = parent.reply(part)
+        # praw returns None when the comment was created but Reddit didn't
+        # send it back; the rest of the chain then goes under the original
+        parent = reply if reply is not None else comment
+        if index == 0:
+            first = reply
+    return first
+
+
+# Runs the bot as three stages connected by bounded queues:
+#
+#   stream reader -> matcher (extract + render) -> pool of reply workers
+#
+# so a slow or rate-limited reply only ties up one worker instead of stalling
+# the stream. When a queue fills up the stage feeding it blocks (counted in
+# stalls and logged), which in turn stops the reader from pulling more
+# comments. Each comment is claimed in the responded store right before its
+# reply and only recorded as responded once the reply went through; failed
+# replies go to the retry spool, if one is given.
+#
+# With a coalescer, reply workers only claim comments and hand them over to be
+# answered in batches per submission (see ReplyCoalescer.collect); the
+# coalescer reports back when each one is done, so waiting for a batch never
+# holds a worker.
+class ReplyPipeline:
+    def __init__(
+        self,
+        comments,
+        render_reply,
+        responded_comments,
+        reply_workers=4,
+        queue_size=100,
+        reply_sink=send_reply,
+        retry_spool=None,
+        checkpoint=None,
+        coalescer=None,
+    ):
+        self.comments = comments
+        self.render_reply = render_reply
+        self.responded_comments = responded_comments
+        self.reply_workers = reply_workers
+        self.reply_sink = reply_sink
+        self.retry_spool = retry_spool
+        self.checkpoint = checkpoint
+        self.coalescer = coalescer
+        self.match_queue = queue.Queue(maxsize=queue_size)
+        self.reply_queue = queue.Queue(maxsize=queue_size)
+        self.stopping = threading.Event()
+        # Checking the responded store and marking a comment in flight happen
+        # under one lock, so comments still waiting in the queues aren't picked
+        # up again if the stream repeats them. The store's own claim(), which
+        # keeps other processes off a comment, happens later in _reply.
+        self.store_lock = threading.Lock()
+        self.in_flight = set()
+        self.stalls = 0
+        self.stalled = {}
+        self.replied = 0
+        self.failed = 0
+        self.threads = []
+
+    # Put an item on a bounded queue, waiting for room
+    def _put(self, target, item, stage):
+        try:
+            target.put_nowait(item)
+            self.stalled[stage] = False
+            return
+        except queue.Full:
+            self.stalls += 1
+            # Only log when the queue first backs up, not for every comment
+            if not self.stalled.get(stage):
+                logger.warning(f"{stage} queue is full, applying backpressure")
+            self.stalled[stage] = True
+        target.put(item)
+
+    def _read_stream(self):
+        try:
+            for comment in self.comments:
+                if self.stopping.is_set():
+                    break
+                with self.store_lock:
+                    if comment.id in self.in_flight or comment.id in self.responded_comments:
+                        continue
+                    if self.retry_spool is not None and comment.id in self.retry_spool:
+                        continue
+                    self.in_flight.add(comment.id)
+                    if self.checkpoint is not None:
+                        self.checkpoint.begin(comment)
+                self._put(self.match_queue, comment, "Match")
+        except Exception as e:
+            logger.error(f"Comment stream failed: {e}")
+        finally:
+            if not self.stopping.is_set():
+                self.match_queue.put(STOP)
+
+    def _match(self):
+        while True:
+            comment = self.match_queue.get()
+            if comment is STOP:
+                break
+            try:
+                logger.info(f"Processing comment: {comment.id}")
+                response = self.render_reply(comment.body)
+            except Exception as e:
+                logger.error(
+                    f"An error occurred while processing comment {comment.id}: {e}"
+                )
+                response = None
+            if response is None:
+                self._release(comment)
+                continue
+            self._put(self.reply_queue, (comment, response), "Reply")
+        for _ in range(self.reply_workers):
+            self.reply_queue.put(STOP)
+
+    def _reply(self):
+        while True:
+            item = self.reply_queue.get()
+            if item is STOP:
+                break
+            comment, response = item
+            # Another bot process may have got to it first
+            if not self.responded_comments.claim(comment.id):
+                self._release(comment)
+                continue
+            if self.coalescer is not None:
+                self.coalescer.collect(
+                    comment,
+                    response,
+                    lambda error, comment=comment, response=response: self._finish(
+                        comment, response, error
+                    ),
+                )
+                continue
+            try:
+                self.reply_sink(comment, response)
+            except Exception as e:
+                self._finish(comment, response, e)
+                continue
+            self._finish(comment, response)
+
+    # Record how a reply went: responded if it went through, otherwise
+    # released and spooled for a retry
+    def _finish(self, comment, response, error=None):
+        if error is not None:
+            logger.error(f"An error occurred while replying to comment {comment.id}: {error}")
+            self.responded_comments.release(comment.id)
+            if self.retry_spool is not None:
+                self.retry_spool.push(comment.id, response, error)
+            with self.store_lock:
+                self.failed += 1
+        else:
+            with self.store_lock:
+                self.responded_comments.add(comment.id)
+                self.replied += 1
+        self._release(comment)
+
+    # Done with a comment, whether it was answered or not
+    def _release(self, comment):
+        with self.store_lock:
+            self.in_flight.discard(comment.id)
+        if self.checkpoint is not None:
+            self.checkpoint.advance(comment)
+
+    def start(self):
+        stages = [("stream-reader", self._read_stream), ("matcher", self._match)]
+        stages += [(f"reply-worker-{i}", self._reply) for i in range(self.reply_workers)]
+        for name, target in stages:
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    # Wait for every stage to finish; short joins keep Ctrl+C working. Once
+    # stopping, the reader may be stuck waiting on the stream, so only the
+    # stages draining the queues are waited for, then the coalescer's batches.
+    def join(self):
+        for thread in self.threads:
+            while thread.is_alive():
+                if thread.name == "stream-reader" and self.stopping.is_set():
+                    break
+                thread.join(0.5)
+        if self.coalescer is not None:
+            # Nothing else will join the open batches
+            self.coalescer.flush()
+            while not self.coalescer.wait(0.5):
+                pass
+
+    def run(self):
+        self.start()
+        self.join()
+
+    # Stop reading new comments and let the ones already queued drain
+    def stop(self):
+        if not self.stopping.is_set():
+            self.stopping.set()
+            self.match_queue.put(STOP)
+            if self.coalescer is not None:
+                self.coalescer.flush()
@@ -0,0 +1,80 @@
+import logging
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Matches Reddit's "try again in 7 minutes" style ratelimit messages
+retry_after_pattern = re.compile(r"(\d+)\s*(second|minute|hour)", re.IGNORECASE)
+retry_after_units = {"second": 1, "minute": 60, "hour": 3600}
+
+
+# How long an error asks us to wait before retrying, in seconds (or None)
+def retry_after(error):
+    message = str(error)
+    if "RATELIMIT" not in message.upper():
+        return None
+    match = retry_after_pattern.search(message)
+    if not match:
+        return None
+    return int(match.group(1)) * retry_after_units[match.group(2).lower()]
+
+
+# Token bucket that paces the bot's writes to Reddit.
+#
+# quota is a callable returning PRAW's view of the API quota (reddit.auth.limits:
+# "remaining" requests until "reset_timestamp"). When that is known, the refill
+# rate spreads what is left of the quota, minus a small reserve for the stream's
+# own reads, over the time until the reset, and writes stop entirely once only
+# the reserve is left. Before Reddit has reported anything the fallback rate
+# and burst are used instead.
+class RateLimiter:
+    def __init__(self, quota=None, rate=0.5, burst=5, reserve=10):
+        self.quota = quota
+        self.fallback_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.reserve = reserve
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _quota_wait(self):
+        limits = self.quota() if self.quota else None
+        remaining = limits.get("remaining") if limits else None
+        reset = limits.get("reset_timestamp") if limits else None
+        if remaining is None or reset is None:
+            self.rate = self.fallback_rate
+            return 0
+        seconds_left = max(reset - time.time(), 0)
+        if remaining <= self.reserve:
+            return seconds_left
+        self.rate = (remaining - self.reserve) / max(seconds_left, 1)
+        return 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Block until a write is allowed
+    def acquire(self):
+        with self.lock:
+            while True:
+                wait = max(self.paused_until - time.monotonic(), self._quota_wait())
+                if wait > 0:
+                    logger.info(f"Rate limited, waiting {wait:.0f}s before replying")
+                    time.sleep(wait)
+                    continue
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                time.sleep((1 - self.tokens) / self.rate)
+
+    # Hold off all writes for a while, e.g. after a RATELIMIT error
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        logger.warning(f"Pausing replies for {seconds}s")
@@ -0,0 +1,123 @@
+import threading
+from collections import OrderedDict
+
+# Reddit rejects comments longer than this
+MAX_COMMENT_LENGTH = 10000
+
+REPLY_HEADER = "Here is some information about the cards you mentioned:\n\n"
+REPLY_FOOTER = "\nThank you for using u/BalatroBot! :)"
+
+
+# Render one card's entry as a Markdown block
+def render_card(card_name, card_info):
+    if isinstance(card_info, dict):
+        # Nested entries (e.g. poker hands) become a bullet list
+        lines = "".join(f"- **{label}:** {value}\n" for label, value in card_info.items())
+        return f"**{card_name}:**\n\n{lines}\n"
+    return f"**{card_name}:**\n{card_info}\n\n"
+
+
+# Reply parts, carrying the names of the cards they explain so later stages
+# don't have to match the comment again
+class Reply(tuple):
+    card_names = ()
+
+
+# Most cards a single reply explains; more would only spread one comment's
+# reply over several chained comments
+MAX_CARDS = 20
+
+
+# Point at an earlier reply that already explained a card
+def render_link(card_name, permalink):
+    return f"**{card_name}:** explained [earlier in this thread]({permalink})\n\n"
+
+
+# Builds replies out of card blocks rendered once up front (or loaded
+# already rendered from the card artifact).
+#
+# Whole replies are cached by the ordered tuple of matched card names, since
+# the same few cards get asked about over and over. A reply is returned as a
+# tuple of parts, each within Reddit's comment length limit: blocks are packed
+# in order into as few parts as fit, with the header on the first part and the
+# footer on the last, so the same cards always split the same way. Cards
+# already explained elsewhere in the thread can be passed as links, which
+# follow the blocks as one line each. Repeated cards are only explained once,
+# and past max_cards the rest are just counted (links don't count towards it).
+class ReplyRenderer:
+    def __init__(
+        self,
+        card_info_dict,
+        cache_size=256,
+        max_length=MAX_COMMENT_LENGTH,
+        blocks=None,
+        max_cards=MAX_CARDS,
+    ):
+        if blocks is None:
+            blocks = {
+                card_name: render_card(card_name, card_info)
+                for card_name, card_info in card_info_dict.items()
+            }
+        self.blocks = blocks
+        self.cache_size = cache_size
+        self.max_length = max_length
+        self.max_cards = max_cards
+        # The matcher and every reply worker render, so the cache and its
+        # counters are only touched under this lock
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _block(self, card_name):
+        block = self.blocks.get(card_name)
+        if block is None:
+            block = f"**{card_name}:** No information available\n\n"
+        return block
+
+    def _split(self, card_names, links=()):
+        blocks = [self._block(card_name) for card_name in card_names[:self.max_cards]]
+        if len(card_names) > self.max_cards:
+            blocks.append(f"...and {len(card_names) - self.max_cards} more\n\n")
+        blocks += [render_link(card_name, permalink) for card_name, permalink in links]
+        parts = []
+        current = REPLY_HEADER
+        for block in blocks:
+            if len(current) + len(block) <= self.max_length:
+                current += block
+                continue
+            if current != REPLY_HEADER:
+                parts.append(current)
+                current = ""
+            # A block too long for a comment of its own is cut into pieces,
+            # the first one filling whatever room is left next to the header
+            while len(current) + len(block) > self.max_length:
+                room = self.max_length - len(current)
+                parts.append(current + block[:room])
+                current = ""
+                block = block[room:]
+            current += block
+        if len(current) + len(REPLY_FOOTER) > self.max_length:
+            parts.append(current)
+            current = ""
+        parts.append(current + REPLY_FOOTER)
+        return tuple(parts)
+
+    # Return the reply parts (a Reply) for the given matched card names, plus
+    # (card name, permalink) links for cards explained earlier
+    def render(self, card_names, links=()):
+        key = (tuple(dict.fromkeys(card_names)), tuple(links))
+        with self.lock:
+            parts = self.cache.get(key)
+            if parts is not None:
+                self.hits += 1
+                self.cache.move_to_end(key)
+                return parts
+            self.misses += 1
+        parts = Reply(self._split(*key))
+        parts.card_names = key[0][:self.max_cards]
+        with self.lock:
+            self.cache[key] = parts
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return parts
@@ -0,0 +1,358 @@
+import hashlib
+import logging
+import math
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+# Interface for remembering which comments the bot has already replied to
+class RespondedStore:
+    def __contains__(self, comment_id):
+        raise NotImplementedError
+
+    def add(self, comment_id):
+        raise NotImplementedError
+
+    # Take a comment before replying to it. Returns False if it has already
+    # been answered or another worker is on it. Stores that only ever serve
+    # one process just check whether it has been answered.
+    def claim(self, comment_id):
+        return comment_id not in self
+
+    # Give up a claim after a failed reply, so it can be retried
+    def release(self, comment_id):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+# Keeps every ID in a set, handy for local runs and benchmarks
+class MemoryRespondedStore(RespondedStore):
+    def __init__(self, comment_ids=()):
+        self.comment_ids = set(comment_ids)
+
+    def __contains__(self, comment_id):
+        return comment_id in self.comment_ids
+
+    def add(self, comment_id):
+        self.comment_ids.add(comment_id)
+
+
+# Wraps another store, timing every call as the "dedup" stage
+class TimedRespondedStore(RespondedStore):
+    def __init__(self, store, metrics):
+        self.store = store
+        self.metrics = metrics
+
+    def __contains__(self, comment_id):
+        with self.metrics.timer("dedup"):
+            return comment_id in self.store
+
+    def add(self, comment_id):
+        with self.metrics.timer("dedup"):
+            self.store.add(comment_id)
+
+    def claim(self, comment_id):
+        with self.metrics.timer("dedup"):
+            return self.store.claim(comment_id)
+
+    def release(self, comment_id):
+        with self.metrics.timer("dedup"):
+            self.store.release(comment_id)
+
+    def flush(self):
+        self.store.flush()
+
+    def close(self):
+        self.store.close()
+
+
+# Fixed-size Bloom filter: "no" answers are certain, "yes" answers may be wrong
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(1, capacity)
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hash_count):
+            yield (first + i * second) % self.size
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+
+# Append-only log of responded comment IDs, one per line.
+#
+# Uses the same format as the old responded_comments.txt, so an existing file
+# is picked up as-is. Each reply appends a single line; the write is handed to
+# the OS straight away (so a crash or dyno restart doesn't lose it) while the
+# fsync is batched. Only a bounded window of recent IDs is kept in memory, with
+# a Bloom filter over the whole log deciding whether an older ID is worth
+# looking up on disk. Every compact_every appends the log is rewritten without
+# duplicates and trimmed to the newest retention IDs, which is far further back
+# than the comment stream ever replays. Safe to share between threads.
+class AppendOnlyRespondedStore(RespondedStore):
+    def __init__(
+        self,
+        path="responded_comments.txt",
+        window=10000,
+        retention=100000,
+        sync_every=20,
+        sync_interval=5.0,
+        compact_every=5000,
+    ):
+        self.path = path
+        self.window = window
+        self.retention = retention
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.compact_every = compact_every
+        self.recent = OrderedDict()
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+        self.appended_since_compact = 0
+        self.file = None
+        self.lock = threading.RLock()
+        # Disk traffic, for benchmarks
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+        comment_ids = self._read_ids()
+        if len(comment_ids) > retention or len(set(comment_ids)) != len(comment_ids):
+            self.compact()
+        else:
+            self._rebuild(comment_ids)
+            self.file = open(self.path, "a")
+            if not self._ends_with_newline():
+                self.file.write("\n")
+                self.file.flush()
+                self.bytes_written += 1
+        logger.info(f"Loaded responded comment store from {self.path}")
+
+    def _read_ids(self):
+        if not os.path.exists(self.path):
+            return []
+        self.bytes_read += os.path.getsize(self.path)
+        with open(self.path, "r") as file:
+            return [line.strip() for line in file if line.strip()]
+
+    def _ends_with_newline(self):
+        if os.path.getsize(self.path) == 0:
+            return True
+        with open(self.path, "rb") as file:
+            file.seek(-1, os.SEEK_END)
+            return file.read(1) == b"\n"
+
+    def _rebuild(self, comment_ids):
+        self.bloom = BloomFilter(self.retention + self.compact_every)
+        for comment_id in comment_ids:
+            self.bloom.add(comment_id)
+        self.recent.clear()
+        for comment_id in comment_ids[-self.window:]:
+            self.recent[comment_id] = None
+
+    def _remember(self, comment_id):
+        self.recent[comment_id] = None
+        self.recent.move_to_end(comment_id)
+        if len(self.recent) > self.window:
+            self.recent.popitem(last=False)
+
+    def _on_disk(self, comment_id):
+        self.file.flush()
+        with open(self.path, "r") as file:
+            for line in file:
+                self.bytes_read += len(line)
+                if line.strip() == comment_id:
+                    return True
+        return False
+
+    def __contains__(self, comment_id):
+        with self.lock:
+            return self._contains(comment_id)
+
+    def _contains(self, comment_id):
+        if comment_id in self.recent:
+            self.recent.move_to_end(comment_id)
+            return True
+        if comment_id not in self.bloom:
+            return False
+        if self._on_disk(comment_id):
+            self._remember(comment_id)
+            return True
+        return False
+
+    def add(self, comment_id):
+        with self.lock:
+            self._add(comment_id)
+
+    def _add(self, comment_id):
+        if comment_id in self.recent:
+            return
+        self.file.write(comment_id + "\n")
+        self.file.flush()
+        self.bytes_written += len(comment_id) + 1
+        self.bloom.add(comment_id)
+        self._remember(comment_id)
+        self.unsynced += 1
+        self.appended_since_compact += 1
+        if (
+            self.unsynced >= self.sync_every
+            or time.monotonic() - self.last_sync >= self.sync_interval
+        ):
+            self.flush()
+        if self.appended_since_compact >= self.compact_every:
+            self.compact()
+
+    # Force buffered appends to disk
+    def flush(self):
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+            self.last_sync = time.monotonic()
+
+    # Rewrite the log without duplicates, keeping only the newest IDs
+    def compact(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+            comment_ids = list(dict.fromkeys(self._read_ids()))[-self.retention:]
+            temp_path = self.path + ".tmp"
+            content = "".join(comment_id + "\n" for comment_id in comment_ids)
+            with open(temp_path, "w") as file:
+                file.write(content)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.path)
+            self.bytes_written += len(content)
+            self._rebuild(comment_ids)
+            self.file = open(self.path, "a")
+            self.unsynced = 0
+            self.last_sync = time.monotonic()
+            self.appended_since_compact = 0
+        logger.info(f"Compacted {self.path} to {len(comment_ids)} comment IDs")
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.flush()
+                self.file.close()
+                self.file = None
+
+
+# Responded store shared by several bot processes on one machine, in SQLite
+# (WAL mode, so readers don't block the writer).
+#
+# A worker claims a comment before replying; the claim is a single upsert, so
+# exactly one worker wins it. A successful reply turns the claim into a
+# "replied" row, a failed one deletes it again. Claims left behind by a worker
+# that died mid-reply can be taken over once they are claim_timeout seconds
+# old. On first start an existing responded_comments.txt is imported.
+class SQLiteRespondedStore(RespondedStore):
+    def __init__(
+        self,
+        path="responded_comments.db",
+        import_path="responded_comments.txt",
+        claim_timeout=600,
+        retention_days=30,
+    ):
+        self.path = path
+        self.claim_timeout = claim_timeout
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responded ("
+            "comment_id TEXT PRIMARY KEY, state TEXT NOT NULL, "
+            "owner TEXT, updated REAL NOT NULL)"
+        )
+        self.connection.execute(
+            "DELETE FROM responded WHERE updated < ?",
+            (time.time() - retention_days * 86400,),
+        )
+        if import_path and os.path.exists(import_path):
+            self._import(import_path)
+        logger.info(f"Opened shared responded comment store {self.path}")
+
+    def _import(self, import_path):
+        with self.lock:
+            if self.connection.execute("SELECT 1 FROM responded LIMIT 1").fetchone():
+                return
+            with open(import_path, "r") as file:
+                comment_ids = [line.strip() for line in file if line.strip()]
+            now = time.time()
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO responded VALUES (?, 'replied', NULL, ?)",
+                [(comment_id, now) for comment_id in comment_ids],
+            )
+            self.connection.execute("COMMIT")
+        logger.info(f"Imported {len(comment_ids)} comment IDs from {import_path}")
+
+    def __contains__(self, comment_id):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT 1 FROM responded WHERE comment_id = ? AND state = 'replied'",
+                (comment_id,),
+            ).fetchone()
+        return row is not None
+
+    def claim(self, comment_id):
+        now = time.time()
+        with self.lock:
+            cursor = self.connection.execute(
+                "INSERT INTO responded VALUES (?, 'claimed', ?, ?) "
+                "ON CONFLICT(comment_id) DO UPDATE SET owner = excluded.owner, "
+                "updated = excluded.updated "
+                "WHERE responded.state = 'claimed' AND responded.updated < ?",
+                (comment_id, self.owner, now, now - self.claim_timeout),
+            )
+        return cursor.rowcount == 1
+
+    def release(self, comment_id):
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM responded WHERE comment_id = ? AND state = 'claimed' AND owner = ?",
+                (comment_id, self.owner),
+            )
+
+    def add(self, comment_id):
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO responded VALUES (?, 'replied', ?, ?) "
+                "ON CONFLICT(comment_id) DO UPDATE SET state = 'replied', "
+                "owner = excluded.owner, updated = excluded.updated",
+                (comment_id, self.owner, time.time()),
+            )
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,118 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from rate_limiter import retry_after
+
+logger = logging.getLogger(__name__)
+
+
+# Replies that failed to post, kept on disk so they survive a restart.
+#
+# Each entry holds the comment ID, the rendered reply and when to try next.
+# Retries back off exponentially with jitter (or wait as long as a RATELIMIT
+# error asks, if longer) and are dropped after max_attempts. Replaying is
+# idempotent: an entry whose comment is already in the responded store is
+# dropped without replying again.
+class RetrySpool:
+    def __init__(
+        self,
+        path="reply_spool.json",
+        base_delay=30,
+        max_delay=3600,
+        max_attempts=8,
+    ):
+        self.path = path
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.lock = threading.RLock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r") as file:
+                self.entries = json.load(file)
+            logger.info(f"Loaded {len(self.entries)} pending replies from {path}")
+
+    def __contains__(self, comment_id):
+        with self.lock:
+            return comment_id in self.entries
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def _save(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as file:
+            json.dump(self.entries, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
+
+    def _delay(self, attempts, error):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        delay *= random.uniform(0.5, 1.5)
+        return max(delay, retry_after(error) or 0)
+
+    # Record a failed reply so it gets retried later
+    def push(self, comment_id, response, error=None):
+        with self.lock:
+            attempts = self.entries.get(comment_id, {}).get("attempts", 0) + 1
+            if attempts > self.max_attempts:
+                logger.error(f"Giving up on replying to comment {comment_id}")
+                self.entries.pop(comment_id, None)
+            else:
+                self.entries[comment_id] = {
+                    "response": response,
+                    "attempts": attempts,
+                    "next_attempt": time.time() + self._delay(attempts, error),
+                }
+            self._save()
+
+    # Retry every entry that is due; send(comment_id, response) posts a reply
+    def replay(self, send, responded_comments):
+        now = time.time()
+        with self.lock:
+            due = [
+                (comment_id, entry["response"])
+                for comment_id, entry in self.entries.items()
+                if entry["next_attempt"] <= now
+            ]
+        for comment_id, response in due:
+            if comment_id in responded_comments:
+                with self.lock:
+                    self.entries.pop(comment_id, None)
+                    self._save()
+                continue
+            # Someone else is replying to it right now; look again next round
+            if not responded_comments.claim(comment_id):
+                continue
+            try:
+                send(comment_id, response)
+            except Exception as e:
+                logger.error(f"Retry of reply to comment {comment_id} failed: {e}")
+                responded_comments.release(comment_id)
+                self.push(comment_id, response, e)
+                continue
+            responded_comments.add(comment_id)
+            with self.lock:
+                self.entries.pop(comment_id, None)
+                self._save()
+            logger.info(f"Retried reply to comment {comment_id}")
+
+    # Replay due entries in a background thread
+    def start(self, send, responded_comments, interval=10):
+        def run():
+            while True:
+                try:
+                    self.replay(send, responded_comments)
+                except Exception as e:
+                    logger.error(f"An error occurred while replaying the retry spool: {e}")
+                time.sleep(interval)
+
+        thread = threading.Thread(target=run, name="retry-spool", daemon=True)
+        thread.start()
+        return thread
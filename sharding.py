@@ -0,0 +1,14 @@
+import zlib
+
+
+# Which of shard_count workers a comment belongs to; the same in every process
+# and across restarts (unlike hash())
+def shard_of(comment_id, shard_count):
+    return zlib.crc32(comment_id.encode()) % shard_count
+
+
+# Keep only the comments that belong to this worker
+def shard_comments(comments, shard_index, shard_count):
+    for comment in comments:
+        if shard_of(comment.id, shard_count) == shard_index:
+            yield comment
@@ -0,0 +1,121 @@
+import threading
+import time
+
+import pytest
+
+from benchmarks.fake_reddit import FakeComment
+from coalescing import ReplyCoalescer, ThreadIndex
+from pipeline import send_reply
+from renderer import ReplyRenderer
+
+CARDS = {"Glass": "x2 Mult", "Steel": "x1.5 Mult", "Stone": "+50 Chips"}
+
+
+@pytest.fixture
+def renderer():
+    return ReplyRenderer(CARDS)
+
+
+def test_thread_index_expires_and_evicts():
+    index = ThreadIndex(max_threads=2, ttl=60)
+    index.record("t3_a", ["Glass"], "/a")
+    index.record("t3_b", ["Steel"], "/b")
+    index.record("t3_c", ["Stone"], "/c")
+    assert index.covered("t3_a") == {}
+    assert index.covered("t3_c") == {"Stone": "/c"}
+    index.ttl = -1
+    assert index.covered("t3_b") == {}
+    assert len(index) == 1
+
+
+def test_covered_cards_are_linked_or_skipped(renderer):
+    coalescer = ReplyCoalescer(renderer.render, send_reply)
+    first = FakeComment("[[Glass]]")
+    coalescer.reply(first, renderer.render(["Glass"]))
+    both = FakeComment("[[Glass]] [[Steel]]")
+    coalescer.reply(both, renderer.render(["Glass", "Steel"]))
+    again = FakeComment("[[Steel]] [[Glass]]")
+    coalescer.reply(again, renderer.render(["Steel", "Glass"]))
+
+    reply = both.replies[0].body
+    assert "**Steel:**\nx1.5 Mult" in reply
+    assert "x2 Mult" not in reply
+    assert first.replies[0].permalink in reply
+    assert again.replies == []
+    assert (coalescer.writes, coalescer.saved) == (2, 1)
+
+
+def test_other_threads_are_answered_in_full(renderer):
+    coalescer = ReplyCoalescer(renderer.render, send_reply)
+    coalescer.reply(FakeComment("[[Glass]]", submission_id="s1"), renderer.render(["Glass"]))
+    other = FakeComment("[[Glass]]", submission_id="s2")
+    coalescer.reply(other, renderer.render(["Glass"]))
+    assert "x2 Mult" in other.replies[0].body
+
+
+def test_mentions_within_the_window_share_one_reply(renderer):
+    coalescer = ReplyCoalescer(renderer.render, send_reply, window=0.2)
+    comments = [FakeComment(f"[[{name}]]") for name in CARDS]
+    outcomes = []
+    started = time.monotonic()
+    for comment, name in zip(comments, CARDS):
+        # collect() never waits for the window
+        coalescer.collect(comment, renderer.render([name]), outcomes.append)
+    assert time.monotonic() - started < 0.1
+    assert coalescer.wait(5)
+    assert outcomes == [None, None, None]
+    assert [len(comment.replies) for comment in comments] == [1, 0, 0]
+    for name in CARDS:
+        assert f"**{name}:**" in comments[0].replies[0].body
+    assert coalescer.saved == 2
+
+
+def test_a_failed_batch_fails_every_comment(renderer):
+    def send(comment, parts):
+        raise RuntimeError("RATELIMIT: try again in 1 minute")
+
+    coalescer = ReplyCoalescer(renderer.render, send, window=0.05)
+    outcomes = []
+    lock = threading.Lock()
+
+    def done(error):
+        with lock:
+            outcomes.append(error)
+
+    for name in CARDS:
+        coalescer.collect(FakeComment(f"[[{name}]]"), renderer.render([name]), done)
+    assert coalescer.wait(5)
+    assert len(outcomes) == 3
+    assert all(isinstance(error, RuntimeError) for error in outcomes)
+    # Nothing was explained, so nothing counts as covered
+    assert coalescer.thread_index.covered("t3_s1") == {}
+
+
+def test_cards_left_out_of_a_reply_are_not_covered():
+    cards = {f"Card{i}": f"Effect {i}" for i in range(30)}
+    renderer = ReplyRenderer(cards)
+    coalescer = ReplyCoalescer(renderer.render, send_reply, window=0.05)
+    names = list(cards)
+    for start in range(0, 30, 10):
+        chunk = names[start:start + 10]
+        coalescer.collect(FakeComment(""), renderer.render(chunk), lambda error: None)
+    assert coalescer.wait(5)
+    later = FakeComment("[[Card25]]")
+    coalescer.reply(later, renderer.render(["Card25"]))
+    assert "Effect 25" in later.replies[0].body
+
+
+def test_a_reply_reddit_did_not_send_back_still_counts(renderer):
+    def send(comment, parts):
+        send_reply(comment, parts)
+        return None
+
+    coalescer = ReplyCoalescer(renderer.render, send, window=0.05)
+    outcomes = []
+    comment = FakeComment("[[Glass]]")
+    coalescer.collect(comment, renderer.render(["Glass"]), outcomes.append)
+    assert coalescer.wait(5)
+    assert outcomes == [None]
+    assert len(comment.replies) == 1
+    # No permalink to link to, so later mentions are answered in full
+    assert coalescer.thread_index.covered("t3_s1") == {}
@@ -0,0 +1,79 @@
+import json
+import re
+from pathlib import Path
+
+import pytest
+
+from matcher import CardIndex
+
+
+with open(Path(__file__).parent.parent / "cards.json", "r", encoding="utf-8") as file:
+    CARD_NAMES = list(json.load(file)["cards"])
+
+
+# The original extract_card_names lookup: a regex scan over every key, first
+# match wins
+def reference_lookup(card_name, card_names):
+    for key in card_names:
+        if re.search(r"\b" + re.escape(card_name) + r"\b", key, re.IGNORECASE):
+            return key
+    return None
+
+
+# Every substring of every card name, as typed and lowercased, plus mentions
+# that only the regex fallback handles
+def partial_names(card_names):
+    mentions = set()
+    for name in card_names:
+        for start in range(len(name)):
+            for end in range(start + 1, len(name) + 1):
+                mentions.add(name[start:end])
+                mentions.add(name[start:end].lower())
+    mentions.update(["", " ", "$", "+1", "The Fool ", " the fool", "Straße", "Ünïcödé"])
+    return sorted(mentions)
+
+
+@pytest.fixture(scope="module")
+def index():
+    return CardIndex(CARD_NAMES)
+
+
+def test_lookup_matches_every_key(index):
+    for name in CARD_NAMES:
+        assert index.lookup(name) == reference_lookup(name, CARD_NAMES)
+
+
+def test_lookup_matches_partial_names(index):
+    mismatches = [
+        mention
+        for mention in partial_names(CARD_NAMES)
+        if index.lookup(mention) != reference_lookup(mention, CARD_NAMES)
+    ]
+    assert mismatches == []
+
+
+def test_lookup_prefers_the_first_name():
+    index = CardIndex(["Blue Seal", "Blue Deck", "Seal"])
+    assert index.lookup("blue") == "Blue Seal"
+    assert index.lookup("seal") == "Blue Seal"
+    assert index.lookup("Deck") == "Blue Deck"
+
+
+def test_extract_finds_every_mention(index):
+    body = "Is [[the fool]] better than [[Blueprint]]? What about [[Glass]]"
+    assert index.extract(body) == [
+        reference_lookup("the fool", CARD_NAMES),
+        reference_lookup("Glass", CARD_NAMES),
+    ]
+
+
+def test_fuzzy_lookup_fixes_typos(index):
+    assert index.extract("[[Temprance]] [[Cerulian Bell]] [[plazma deck]]") == [
+        "Temperance",
+        "Cerulean Bell",
+        "Plasma Deck",
+    ]
+
+
+def test_fuzzy_lookup_leaves_short_words_alone(index):
+    assert index.extract("[[hand]] [[hands]] [[seeds]] [[Blueprint]]") == []
@@ -0,0 +1,115 @@
+import threading
+import time
+
+from benchmarks.fake_reddit import FakeComment
+from checkpoint import Checkpoint
+from pipeline import ReplyPipeline, send_reply
+from responded_store import MemoryRespondedStore
+from retry_spool import RetrySpool
+
+
+def render_reply(comment_body):
+    return ("reply",) if "[[" in comment_body else None
+
+
+def run_pipeline(comments, store, **kwargs):
+    pipeline = ReplyPipeline(iter(comments), render_reply, store, queue_size=5, **kwargs)
+    pipeline.run()
+    return pipeline
+
+
+def test_every_mention_is_answered_once():
+    comments = [FakeComment("[[Glass]]" if i % 3 else "no mention") for i in range(60)]
+    # The stream repeats comments, as praw's does around reconnects
+    stream = comments + comments[::2] + comments
+    store = MemoryRespondedStore()
+    pipeline = run_pipeline(stream, store, reply_workers=4)
+    for comment in comments:
+        assert len(comment.replies) == (1 if "[[" in comment.body else 0)
+    assert pipeline.replied == 40
+
+
+def test_comment_is_recorded_only_after_its_reply():
+    store = MemoryRespondedStore()
+    recorded_before_reply = []
+
+    def reply_sink(comment, response):
+        recorded_before_reply.append(comment.id in store)
+        return send_reply(comment, response)
+
+    comments = [FakeComment("[[Glass]]") for _ in range(20)]
+    run_pipeline(comments, store, reply_workers=4, reply_sink=reply_sink)
+    assert recorded_before_reply == [False] * 20
+    assert all(comment.id in store for comment in comments)
+
+
+def test_failed_replies_are_spooled(tmp_path):
+    store = MemoryRespondedStore()
+    spool = RetrySpool(str(tmp_path / "reply_spool.json"))
+    comments = [FakeComment("[[Glass]]") for _ in range(10)]
+    failing = {comment.id for comment in comments[::2]}
+
+    def reply_sink(comment, response):
+        if comment.id in failing:
+            raise RuntimeError("RATELIMIT: try again in 1 minute")
+        return send_reply(comment, response)
+
+    pipeline = run_pipeline(comments, store, reply_workers=3, reply_sink=reply_sink, retry_spool=spool)
+    assert pipeline.failed == 5
+    for comment in comments:
+        assert (comment.id in store) == (comment.id not in failing)
+        assert (comment.id in spool) == (comment.id in failing)
+    # A restarted bot skips what is waiting in the spool
+    again = run_pipeline(comments, store, reply_workers=3, retry_spool=spool)
+    assert again.replied == 0
+
+
+def test_checkpoint_waits_for_queued_replies(tmp_path):
+    started = time.time()
+    comments = [
+        FakeComment("[[Glass]]" if i == 0 else "no mention", created_utc=started + i)
+        for i in range(20)
+    ]
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.json"), save_every=1)
+    blocked = threading.Event()
+
+    def reply_sink(comment, response):
+        blocked.wait()
+        return send_reply(comment, response)
+
+    pipeline = ReplyPipeline(
+        iter(comments),
+        render_reply,
+        MemoryRespondedStore(),
+        reply_workers=1,
+        reply_sink=reply_sink,
+        checkpoint=checkpoint,
+    )
+    def unfinished():
+        with checkpoint.lock:
+            return [comment for comment, finished in checkpoint.in_flight.values() if not finished]
+
+    pipeline.start()
+    deadline = time.monotonic() + 5
+    while len(checkpoint.in_flight) < len(comments) or unfinished() != [comments[0]]:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    # Everything after the first comment is done, but its reply isn't
+    assert checkpoint.fullname is None
+    blocked.set()
+    pipeline.join()
+    assert checkpoint.fullname == comments[-1].fullname
+
+
+# praw's reply() returns None when Reddit creates the comment but doesn't
+# send it back
+class SilentComment(FakeComment):
+    def reply(self, body):
+        FakeComment.reply(self, body)
+        return None
+
+
+def test_replies_reddit_did_not_send_back_count_as_posted():
+    comment = SilentComment("[[Glass]]")
+    assert send_reply(comment, ("part 1", "part 2")) is None
+    assert [reply.body for reply in comment.replies] == ["part 1", "part 2"]
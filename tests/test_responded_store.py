@@ -0,0 +1,62 @@
+import os
+
+from responded_store import AppendOnlyRespondedStore, SQLiteRespondedStore
+
+
+def open_workers(tmp_path, count=2, **kwargs):
+    path = str(tmp_path / "responded_comments.db")
+    stores = []
+    for worker in range(count):
+        store = SQLiteRespondedStore(path, import_path=None, **kwargs)
+        # As if each were a separate process
+        store.owner = f"worker-{worker}"
+        stores.append(store)
+    return stores
+
+
+def test_only_one_worker_can_claim_a_comment(tmp_path):
+    first, second = open_workers(tmp_path)
+    assert first.claim("c1")
+    assert not second.claim("c1")
+    assert "c1" not in second
+    first.add("c1")
+    assert "c1" in second
+    assert not second.claim("c1")
+
+
+def test_released_claims_can_be_taken(tmp_path):
+    first, second = open_workers(tmp_path)
+    assert first.claim("c1")
+    # Only the owner can release a claim
+    second.release("c1")
+    assert not second.claim("c1")
+    first.release("c1")
+    assert second.claim("c1")
+
+
+def test_stale_claims_are_taken_over(tmp_path):
+    first, second = open_workers(tmp_path, claim_timeout=-1)
+    assert first.claim("c1")
+    assert second.claim("c1")
+    second.add("c1")
+    assert not first.claim("c1")
+
+
+def test_sqlite_store_imports_the_text_file(tmp_path):
+    text_path = tmp_path / "responded_comments.txt"
+    text_path.write_text("a1\nb2\n")
+    store = SQLiteRespondedStore(str(tmp_path / "responded_comments.db"), import_path=str(text_path))
+    assert "a1" in store and "b2" in store
+    assert not store.claim("a1")
+
+
+def test_append_only_store_survives_a_restart(tmp_path):
+    path = str(tmp_path / "responded_comments.txt")
+    store = AppendOnlyRespondedStore(path)
+    for i in range(100):
+        store.add(f"c{i}")
+    store.close()
+    reopened = AppendOnlyRespondedStore(path)
+    assert all(f"c{i}" in reopened for i in range(100))
+    assert "c100" not in reopened
+    assert os.path.getsize(path) > 0